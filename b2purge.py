@@ -1,23 +1,76 @@
 import argparse
+import asyncio
+import heapq
+import itertools
+import json
 import logging
 import os
+import queue
 import random
+import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from logging.handlers import RotatingFileHandler
+from functools import lru_cache, partial
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import cast
 
 import b2sdk.v2 as b2
+import httpx
 from humanize import naturalsize
 
+try:
+    import aiohttp
+except ImportError:  # Only needed for --async.
+    aiohttp = None
+
 # Keep a conservative default to reduce API rate-limit risk.
 DEFAULT_WORKERS = max(1, min(8, (os.cpu_count() or 1) * 2))
 DEFAULT_BATCH_SIZE = 10000
+# Maximum page size accepted by b2_list_file_versions.
+LIST_PAGE_SIZE = 10000
+# Batches listed ahead while the current one is being processed.
+PREFETCH_DEPTH = 2
 DEFAULT_MAX_RETRIES = 5
 RETRY_BASE_DELAY = 0.5
 RETRY_MAX_DELAY = 8.0
+# Active delete workers are retuned every CONTROL_INTERVAL seconds from a ~1s
+# moving average of the share of deletes that were rate limited.
+CONTROL_INTERVAL = 0.1
+RATE_LIMIT_EWMA_ALPHA = 0.1
+RATE_LIMIT_HIGH = 0.05
+RATE_LIMIT_LOW = 0.01
+DELETE_FILE_VERSION_PATH = "/b2api/v2/b2_delete_file_version"
+HTTP_TIMEOUT = 60.0
+# Grace period between B2 hiding a file and deleting it for good.
+LIFECYCLE_DAYS_FROM_HIDING_TO_DELETING = 1
+# Listing entries that aren't stored files, so b2_delete_file_version isn't
+# sent for them; they are only reported.
+SKIPPED_ACTIONS = {
+    "hide": "hide markers",
+    "start": "unfinished large file uploads",
+}
+# Connection failures and timeouts, retried like a 5xx response.
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    httpx.RemoteProtocolError,
+)
+if aiohttp is not None:
+    TRANSIENT_ERRORS += (aiohttp.ClientError,)
+
+# Console log lines are written out in chunks of up to this many records, and
+# at least every this many seconds, instead of one write per line.
+LOG_BUFFER_RECORDS = 4096
+LOG_FLUSH_INTERVAL = 1.0
+
+# Many files share a size (generated artifacts, backups), so per-file log lines
+# reuse the formatted size instead of recomputing it.
+format_size = lru_cache(maxsize=4096)(naturalsize)
 
 RESET = "\033[0m"
 RED = "\033[91m"
@@ -42,17 +95,58 @@ class ColoredFormatter(logging.Formatter):
         return super().format(record)
 
 
-def setup_logging(log_level: str, log_file: str | None = None) -> logging.Logger:
+class BufferedStreamHandler(logging.StreamHandler):
+    """Writes buffered log lines with one write call instead of one per record."""
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._lines = []
+        self._closed = threading.Event()
+        # Flush on a timer too, so lines don't sit in the buffer while the log
+        # is quiet (e.g. during a long listing page).
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def emit(self, record):
+        try:
+            self._lines.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        # Warnings and errors go out immediately so they aren't delayed or lost.
+        if len(self._lines) >= LOG_BUFFER_RECORDS or record.levelno >= logging.WARNING:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self._lines:
+                self.stream.write("".join(self._lines))
+                self._lines.clear()
+            super().flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        super().close()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(LOG_FLUSH_INTERVAL):
+            self.flush()
+
+
+def setup_logging(
+    log_level: str, log_file: str | None = None
+) -> tuple[logging.Logger, QueueListener]:
     logger = logging.getLogger("b2purge")
     logger.setLevel(getattr(logging, log_level))
     logger.handlers.clear()
 
-    console_handler = logging.StreamHandler()
+    console_handler = BufferedStreamHandler()
     console_formatter = ColoredFormatter(
         "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
     )
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
 
     if log_file:
         file_handler = RotatingFileHandler(
@@ -62,12 +156,19 @@ def setup_logging(log_level: str, log_file: str | None = None) -> logging.Logger
             "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
         )
         file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    # Delete workers only enqueue records; one listener thread does the
+    # formatting and I/O, so they never wait on the handler locks.
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
 
-    return logger
+    return logger, listener
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class OldFile:
     # Immutable snapshot so threaded deletes don't share mutable state.
     file_id: str
@@ -76,6 +177,22 @@ class OldFile:
     upload_timestamp_ms: int
 
 
+class B2DeleteError(Exception):
+    # Error body returned by a raw b2_delete_file_version call.
+    def __init__(self, status, code, message):
+        super().__init__(f"{status} {code}: {message}")
+        self.status = status
+        self.code = code
+
+    @classmethod
+    def from_response(cls, status, body):
+        try:
+            error = json.loads(body)
+        except ValueError:
+            error = {}
+        return cls(status, error.get("code"), error.get("message", body))
+
+
 def is_rate_limit_error(exc):
     status = getattr(exc, "status", None) or getattr(exc, "status_code", None)
     if status == 429:
@@ -86,32 +203,360 @@ def is_rate_limit_error(exc):
         "rate_limit_exceeded",
     }:
         return True
+    if isinstance(exc, B2DeleteError):
+        # The message can quote the file name, so don't search it.
+        return False
     message = str(exc).lower()
     return "too many requests" in message or "rate limit" in message or "429" in message
 
 
-def batch_generator(bucket, folder_path, cutoff_ms, batch_size):
+def is_retryable_error(exc):
+    # What b2sdk would have retried: throttling, request timeouts, server
+    # errors, expired tokens (reauthorized by the caller) and lost connections.
+    if isinstance(exc, B2DeleteError):
+        return (
+            exc.status == 408
+            or exc.status >= 500
+            or exc.code == "expired_auth_token"
+            or is_rate_limit_error(exc)
+        )
+    return isinstance(exc, TRANSIENT_ERRORS) or is_rate_limit_error(exc)
+
+
+def retry_delay(prev_delay):
+    # Decorrelated jitter spreads out retries from workers throttled together.
+    return min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, prev_delay * 3))
+
+
+class AdaptiveConcurrency:
+    """Parks delete workers while B2 is rate limiting and wakes them as it recovers."""
+
+    def __init__(self, max_workers, logger, backlog):
+        self.max_workers = max_workers
+        self.active_workers = max_workers
+        self._logger = logger
+        self._backlog = backlog
+        self._completed = 0
+        self._rate_limited = 0
+        self._rate = 0.0
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._controller = threading.Thread(
+            target=self._control, name="b2ctl", daemon=True
+        )
+
+    def start(self):
+        self._controller.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._controller.join()
+
+    def wait_turn(self, worker_id):
+        # Workers above the current limit park here instead of exiting.
+        with self._condition:
+            self._condition.wait_for(
+                lambda: worker_id < self.active_workers or self._stopped.is_set()
+            )
+
+    def record(self, rate_limited):
+        with self._condition:
+            self._completed += 1
+            self._rate_limited += rate_limited
+
+    def _control(self):
+        while not self._stopped.wait(CONTROL_INTERVAL):
+            with self._condition:
+                if self._completed:
+                    sample = self._rate_limited / self._completed
+                    self._rate += RATE_LIMIT_EWMA_ALPHA * (sample - self._rate)
+                    self._completed = self._rate_limited = 0
+                if self._rate > RATE_LIMIT_HIGH and self.active_workers > 1:
+                    self.active_workers -= 1
+                elif (
+                    self._rate < RATE_LIMIT_LOW
+                    and self._backlog()
+                    and self.active_workers < self.max_workers
+                ):
+                    self.active_workers += 1
+                    self._condition.notify_all()
+                else:
+                    continue
+                active_workers, rate = self.active_workers, self._rate
+            self._logger.debug(
+                f"Rate limited {rate:.1%} of deletes, {active_workers}/{self.max_workers} workers active"
+            )
+
+
+class DeletePool:
+    """Long-lived delete workers fed from a bounded queue, without per-task futures."""
+
+    def __init__(self, delete, workers, queue_size, logger):
+        self._delete = delete
+        self._logger = logger
+        # A file holds its slot from submit() until its final result is posted,
+        # including while it waits to be retried, so throttling can't grow the
+        # number of files in flight.
+        self._slots = threading.Semaphore(queue_size)
+        self._tasks = queue.SimpleQueue()
+        # (OldFile, exception or None) for every finished delete.
+        self.results = queue.SimpleQueue()
+        self.concurrency = AdaptiveConcurrency(workers, logger, self._tasks.qsize)
+        self._workers = [
+            threading.Thread(
+                target=self._work, args=(worker_id,), name=f"b2del-{worker_id}"
+            )
+            for worker_id in range(workers)
+        ]
+        # (due time, sequence number, task) heap of deletes waiting to be retried.
+        self._retries = []
+        self._retry_sequence = itertools.count()
+        self._retry_ready = threading.Condition()
+        self._closing = False
+        self._retry_scheduler = threading.Thread(
+            target=self._schedule_retries, name="b2del-retry"
+        )
+
+    def __enter__(self):
+        self.concurrency.start()
+        self._retry_scheduler.start()
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.concurrency.stop()
+        with self._retry_ready:
+            self._closing = True
+            self._retry_ready.notify()
+        self._retry_scheduler.join()
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def submit(self, old_file):
+        # Blocks while queue_size files are in flight.
+        self._slots.acquire()
+        self._tasks.put((old_file, 0, RETRY_BASE_DELAY))
+
+    def _work(self, worker_id):
+        while True:
+            self.concurrency.wait_turn(worker_id)
+            task = self._tasks.get()
+            if task is None:
+                return
+            old_file, attempt, prev_delay = task
+            try:
+                self._delete(old_file)
+            except Exception as exc:
+                self.concurrency.record(is_rate_limit_error(exc))
+                if is_retryable_error(exc) and attempt < DEFAULT_MAX_RETRIES:
+                    self._retry_later(old_file, attempt, prev_delay, exc)
+                else:
+                    self._finish(old_file, exc)
+            else:
+                self.concurrency.record(False)
+                self._finish(old_file, None)
+
+    def _finish(self, old_file, exc):
+        self.results.put((old_file, exc))
+        self._slots.release()
+
+    def _retry_later(self, old_file, attempt, prev_delay, exc):
+        # Hand the retry to the scheduler so the worker moves on instead of sleeping.
+        delay = retry_delay(prev_delay)
+        self._logger.warning(
+            f"Failed to delete {old_file.file_name} ({exc}), retrying in {delay:.2f}s (attempt {attempt + 1}/{DEFAULT_MAX_RETRIES})"
+        )
+        with self._retry_ready:
+            heapq.heappush(
+                self._retries,
+                (
+                    time.monotonic() + delay,
+                    next(self._retry_sequence),
+                    (old_file, attempt + 1, delay),
+                ),
+            )
+            self._retry_ready.notify()
+
+    def _schedule_retries(self):
+        # Requeues each retry once its backoff has passed.
+        while True:
+            with self._retry_ready:
+                while not self._closing:
+                    timeout = None
+                    if self._retries:
+                        timeout = self._retries[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._retry_ready.wait(timeout)
+                if self._closing:
+                    return
+                task = heapq.heappop(self._retries)[-1]
+            self._tasks.put(task)
+
+
+def list_file_versions(bucket, folder_path):
+    """Yields pages of raw file version dicts under folder_path."""
+    # Page through the raw b2_list_file_versions responses instead of bucket.ls()
+    # so no FileVersion objects, folder tuples or latest-only filtering are
+    # built for files that are then thrown away. Every version is listed.
+    session = bucket.api.session
+    start_file_name = folder_path
+    start_file_id = None
+    while True:
+        response = session.list_file_versions(
+            bucket.id_,
+            start_file_name=start_file_name,
+            start_file_id=start_file_id,
+            max_file_count=LIST_PAGE_SIZE,
+            prefix=folder_path,
+        )
+        yield response["files"]
+        start_file_name = response.get("nextFileName")
+        start_file_id = response.get("nextFileId")
+        if start_file_name is None:
+            break
+
+
+def log_skipped_entries(skipped, logger):
+    """Reports old listing entries that were left alone because they aren't files."""
+    for action, count in skipped.items():
+        logger.info(
+            f"Skipped {count} old {SKIPPED_ACTIONS.get(action, f'{action!r} entries')}"
+        )
+
+
+def batch_generator(bucket, folder_path, cutoff_ms, batch_size, logger):
     """Yields batches of OldFile objects to limit memory usage."""
+    # This loop runs once per listed version, so keep lookups in locals.
+    make_old_file = OldFile
     batch = []
-    for file_version, _ in bucket.ls(folder_path, recursive=True):
-        if file_version.upload_timestamp < cutoff_ms:
-            batch.append(
-                OldFile(
-                    file_id=file_version.id_,
-                    file_name=file_version.file_name,
-                    file_size=file_version.size,
-                    upload_timestamp_ms=file_version.upload_timestamp,
+    append = batch.append
+    skipped = Counter()
+    for files in list_file_versions(bucket, folder_path):
+        for entry in files:
+            upload_timestamp_ms = entry["uploadTimestamp"]
+            if upload_timestamp_ms < cutoff_ms:
+                if entry["action"] != "upload":
+                    skipped[entry["action"]] += 1
+                    continue
+                append(
+                    make_old_file(
+                        entry["fileId"],
+                        entry["fileName"],
+                        entry["contentLength"],
+                        upload_timestamp_ms,
+                    )
                 )
-            )
-            if len(batch) >= batch_size:
-                yield batch
-                batch = []
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+                    append = batch.append
     if batch:
         yield batch
+    log_skipped_entries(skipped, logger)
+
+
+def dry_run_scan(bucket, folder_path, cutoff_ms, logger, log_files):
+    """Totals up old files straight from the listing without building OldFiles."""
+    total_bytes = 0
+    total_old_files = 0
+    page_num = 0
+    skipped = Counter()
+
+    for files in prefetch(list_file_versions(bucket, folder_path)):
+        page_num += 1
+        for entry in files:
+            upload_timestamp_ms = entry["uploadTimestamp"]
+            if upload_timestamp_ms >= cutoff_ms:
+                continue
+            if entry["action"] != "upload":
+                skipped[entry["action"]] += 1
+                continue
+            file_size = entry["contentLength"]
+            total_bytes += file_size
+            total_old_files += 1
+            if log_files:
+                file_mod_time = datetime.fromtimestamp(upload_timestamp_ms / 1000)
+                logger.info(
+                    f"Dry run: Would delete {entry['fileName']} (last modified: {file_mod_time}, size: {format_size(file_size)})"
+                )
+
+        logger.info(
+            f"Page {page_num} complete: {len(files)} files listed, {total_old_files} total old files found"
+        )
+
+    log_skipped_entries(skipped, logger)
+    logger.info(
+        f"Dry run summary: Would delete {total_old_files} files ({naturalsize(total_bytes)} would be cleared)"
+    )
+
+
+def prefetch(iterable, depth=PREFETCH_DEPTH):
+    """Yields items from iterable while a background thread fetches the next ones."""
+    items = queue.Queue(maxsize=depth)
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as exc:
+            items.put(exc)
+        else:
+            items.put(None)
+
+    threading.Thread(target=produce, name="b2list", daemon=True).start()
+    while (item := items.get()) is not None:
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def install_lifecycle_rule(bucket, folder_path, days, dry_run, logger):
+    """Has B2 hide and then delete files under folder_path once they are old."""
+    rule = {
+        "fileNamePrefix": folder_path,
+        "daysFromUploadingToHiding": days,
+        "daysFromHidingToDeleting": LIFECYCLE_DAYS_FROM_HIDING_TO_DELETING,
+    }
+    # Lifecycle rules are replaced wholesale, so keep the other prefixes' rules.
+    # get_bucket_by_name() may return a cached bucket without its rules or
+    # revision (e.g. for keys restricted to one bucket), so fetch it fresh.
+    bucket = bucket.get_fresh_state()
+    if bucket.revision is None:
+        raise RuntimeError(
+            f"Cannot read the current lifecycle rules of bucket {bucket.name}; not updating them."
+        )
+    lifecycle_rules = [
+        existing
+        for existing in bucket.lifecycle_rules
+        if existing.get("fileNamePrefix") != folder_path
+    ]
+    lifecycle_rules.append(rule)
+
+    if dry_run:
+        logger.info(f"Dry run: Would install lifecycle rule {rule}")
+        return
+
+    bucket.update(lifecycle_rules=lifecycle_rules, if_revision_is=bucket.revision)
+    logger.info(f"Installed lifecycle rule {rule}")
 
 
 def delete_old_files(
-    bucket_name, folder_path, days, dry_run, workers, batch_size, logger
+    bucket_name,
+    folder_path,
+    days,
+    dry_run,
+    workers,
+    batch_size,
+    logger,
+    use_async,
+    quiet,
+    install_lifecycle,
 ):
     info = cast(b2.AbstractAccountInfo, b2.InMemoryAccountInfo())
     b2_api = b2.B2Api(info)
@@ -124,92 +569,185 @@ def delete_old_files(
     b2_api.authorize_account("production", application_key_id, application_key)
 
     bucket = b2_api.get_bucket_by_name(bucket_name)
-    folder_path = folder_path.rstrip("/") + "/"
 
     cutoff_ms = int((datetime.now() - timedelta(days=days)).timestamp() * 1000)
+    # Skip building per-file messages entirely when nobody will see them.
+    log_files = not quiet and logger.isEnabledFor(logging.INFO)
+
+    if install_lifecycle:
+        # B2 expires new files from here on; the run below clears the backlog.
+        install_lifecycle_rule(bucket, folder_path, days, dry_run, logger)
 
     if dry_run:
-        total_bytes = 0
-        total_old_files = 0
-        total_scanned = 0
-        batch_num = 0
-
-        for batch in batch_generator(bucket, folder_path, cutoff_ms, batch_size):
-            batch_num += 1
-            batch_old_files = len(batch)
-            total_old_files += batch_old_files
-            total_scanned += batch_size
-
-            for old_file in batch:
+        dry_run_scan(bucket, folder_path, cutoff_ms, logger, log_files)
+        return
+
+    # Deletes go straight to the API rather than through b2sdk, reusing one
+    # authorized connection pool for the whole run.
+    url = b2_api.account_info.get_api_url() + DELETE_FILE_VERSION_PATH
+    headers = {"Authorization": b2_api.account_info.get_account_auth_token()}
+    auth_lock = threading.Lock()
+
+    def refresh_auth(expired_token):
+        # Every delete in flight sees the token expire; only reauthorize once.
+        with auth_lock:
+            if headers["Authorization"] == expired_token:
+                b2_api.session.authorize_automatically()
+                headers["Authorization"] = b2_api.account_info.get_account_auth_token()
+
+    def delete_old_file(client, old_file):
+        # Retries are handled by DeletePool.
+        token = headers["Authorization"]
+        response = client.post(
+            url,
+            headers={"Authorization": token},
+            json={"fileId": old_file.file_id, "fileName": old_file.file_name},
+        )
+        if response.status_code != 200:
+            error = B2DeleteError.from_response(response.status_code, response.text)
+            if error.code == "expired_auth_token":
+                refresh_auth(token)
+            raise error
+
+    deleted_bytes = 0
+    deleted_count = 0
+    failed_count = 0
+    failed_bytes = 0
+    batch_num = 0
+    # Deletes still running, bounded so listing can't run far ahead of them.
+    max_in_flight = workers * 4
+
+    def record(old_file, exc):
+        nonlocal deleted_bytes, deleted_count, failed_count, failed_bytes
+        if exc is not None:
+            failed_count += 1
+            failed_bytes += old_file.file_size
+            file_mod_time = datetime.fromtimestamp(old_file.upload_timestamp_ms / 1000)
+            logger.error(
+                f"Failed to delete {old_file.file_name} (last modified: {file_mod_time}, size: {format_size(old_file.file_size)}): {exc}"
+            )
+        else:
+            deleted_bytes += old_file.file_size
+            deleted_count += 1
+            if log_files:
                 file_mod_time = datetime.fromtimestamp(
                     old_file.upload_timestamp_ms / 1000
                 )
-                total_bytes += old_file.file_size
                 logger.info(
-                    f"Dry run: Would delete {old_file.file_name} (last modified: {file_mod_time}, size: {naturalsize(old_file.file_size)})"
+                    f"Deleted {old_file.file_name} (last modified: {file_mod_time}, size: {format_size(old_file.file_size)})"
                 )
 
-            logger.info(
-                f"Batch {batch_num} complete: {batch_old_files} old files in this batch, {total_old_files} total old files found"
-            )
-
-        logger.info(
-            f"Dry run summary: Would delete {total_old_files} files ({naturalsize(total_bytes)} would be cleared)"
+    async def delete_old_files_async():
+        nonlocal batch_num
+        semaphore = asyncio.Semaphore(workers)
+        batches = prefetch(
+            batch_generator(bucket, folder_path, cutoff_ms, batch_size, logger)
         )
-        return
 
-    def delete_old_file(old_file):
-        for attempt in range(DEFAULT_MAX_RETRIES + 1):
-            try:
-                bucket.delete_file_version(old_file.file_id, old_file.file_name)
-                return old_file
-            except Exception as exc:
-                if not is_rate_limit_error(exc) or attempt == DEFAULT_MAX_RETRIES:
-                    raise
-                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2**attempt))
-                delay *= 0.8 + random.random() * 0.4
-                logger.warning(
-                    f"Rate limit hit for {old_file.file_name}, retrying in {delay:.2f}s (attempt {attempt + 1}/{DEFAULT_MAX_RETRIES})"
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=workers),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        ) as session:
+
+            async def delete_old_file_async(old_file):
+                delay = RETRY_BASE_DELAY
+                for attempt in range(DEFAULT_MAX_RETRIES + 1):
+                    token = headers["Authorization"]
+                    try:
+                        async with (
+                            semaphore,
+                            session.post(
+                                url,
+                                headers={"Authorization": token},
+                                json={
+                                    "fileId": old_file.file_id,
+                                    "fileName": old_file.file_name,
+                                },
+                            ) as response,
+                        ):
+                            if response.status == 200:
+                                return old_file, None
+                            raise B2DeleteError.from_response(
+                                response.status, await response.text()
+                            )
+                    except Exception as exc:
+                        if (
+                            not is_retryable_error(exc)
+                            or attempt == DEFAULT_MAX_RETRIES
+                        ):
+                            return old_file, exc
+                        if getattr(exc, "code", None) == "expired_auth_token":
+                            await asyncio.to_thread(refresh_auth, token)
+                        delay = retry_delay(delay)
+                        logger.warning(
+                            f"Failed to delete {old_file.file_name} ({exc}), retrying in {delay:.2f}s (attempt {attempt + 1}/{DEFAULT_MAX_RETRIES})"
+                        )
+                        # Back off without holding a request slot.
+                        await asyncio.sleep(delay)
+
+            # The listing thread blocks, so pull batches off the event loop.
+            in_flight = set()
+            while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                batch_num += 1
+
+                for old_file in batch:
+                    in_flight.add(asyncio.create_task(delete_old_file_async(old_file)))
+                    if len(in_flight) >= max_in_flight:
+                        done, in_flight = await asyncio.wait(
+                            in_flight, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for task in done:
+                            record(*task.result())
+
+                logger.info(
+                    f"Batch {batch_num} submitted: {deleted_count} total deleted, {failed_count} total failed"
                 )
-                time.sleep(delay)
 
-    deleted_bytes = 0
-    deleted_count = 0
-    failed_count = 0
-    failed_bytes = 0
-    batch_num = 0
+            if in_flight:
+                done, _ = await asyncio.wait(in_flight)
+                for task in done:
+                    record(*task.result())
 
-    for batch in batch_generator(bucket, folder_path, cutoff_ms, batch_size):
-        batch_num += 1
+    if use_async:
+        asyncio.run(delete_old_files_async())
+    else:
+        # Deletes handed to the pool whose results haven't been recorded yet.
+        pending = 0
+
+        # HTTP/2 multiplexes concurrent deletes over a few kept-alive connections.
+        with (
+            httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=workers, max_keepalive_connections=workers
+                ),
+                timeout=HTTP_TIMEOUT,
+            ) as client,
+            DeletePool(
+                partial(delete_old_file, client), workers, max_in_flight, logger
+            ) as pool,
+        ):
+            results = pool.results
+            for batch in prefetch(
+                batch_generator(bucket, folder_path, cutoff_ms, batch_size, logger)
+            ):
+                batch_num += 1
+
+                for old_file in batch:
+                    # Blocks while max_in_flight files are in flight.
+                    pool.submit(old_file)
+                    pending += 1
+                    while not results.empty():
+                        record(*results.get())
+                        pending -= 1
 
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_old_file = {
-                executor.submit(delete_old_file, old_file): old_file
-                for old_file in batch
-            }
-            for future in as_completed(future_to_old_file):
-                old_file = future_to_old_file[future]
-                file_mod_time = datetime.fromtimestamp(
-                    old_file.upload_timestamp_ms / 1000
+                logger.info(
+                    f"Batch {batch_num} submitted: {deleted_count} total deleted, {failed_count} total failed"
                 )
-                try:
-                    future.result()
-                except Exception as exc:
-                    failed_count += 1
-                    failed_bytes += old_file.file_size
-                    logger.error(
-                        f"Failed to delete {old_file.file_name} (last modified: {file_mod_time}, size: {naturalsize(old_file.file_size)}): {exc}"
-                    )
-                else:
-                    deleted_bytes += old_file.file_size
-                    deleted_count += 1
-                    logger.info(
-                        f"Deleted {old_file.file_name} (last modified: {file_mod_time}, size: {naturalsize(old_file.file_size)})"
-                    )
 
-        logger.info(
-            f"Batch {batch_num} complete: {deleted_count} total deleted, {failed_count} total failed"
-        )
+            while pending:
+                record(*results.get())
+                pending -= 1
 
     if failed_count > 0:
         logger.warning(
@@ -221,13 +759,18 @@ def delete_old_files(
         )
 
 
+def folder_prefix(folder_path):
+    # Normalized once here; every listing request reuses the same prefix string.
+    return sys.intern(folder_path.rstrip("/") + "/")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Delete old files from B2 bucket.", allow_abbrev=False
     )
     parser.add_argument("bucket_name", type=str, help="Name of the B2 bucket")
     parser.add_argument(
-        "folder_path", type=str, help="Path to the folder in the B2 bucket"
+        "folder_path", type=folder_prefix, help="Path to the folder in the B2 bucket"
     )
     parser.add_argument(
         "days", type=int, help="Number of days old the files should be to be deleted"
@@ -241,13 +784,24 @@ def main():
         "--workers",
         type=int,
         default=DEFAULT_WORKERS,
-        help="Number of concurrent delete workers (ignored for dry run)",
+        help="Maximum number of concurrent delete workers, scaled down while rate limited (ignored for dry run)",
     )
     parser.add_argument(
         "--batch-size",
         type=int,
         default=DEFAULT_BATCH_SIZE,
-        help="Number of files to process in each batch (affects memory usage)",
+        help="Number of files to process in each batch (affects memory usage, ignored for dry run)",
+    )
+    parser.add_argument(
+        "--install-lifecycle",
+        action="store_true",
+        help="Install a bucket lifecycle rule so B2 expires future files itself, then delete the current backlog",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Delete with asyncio and aiohttp on a single thread instead of a thread pool",
     )
     parser.add_argument(
         "--log-level",
@@ -255,6 +809,11 @@ def main():
         default="INFO",
         help="Logging level (default: INFO)",
     )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Only log batch progress, failures and the summary, not every file",
+    )
     parser.add_argument(
         "--log-file",
         type=str,
@@ -272,17 +831,28 @@ def main():
     if args.batch_size <= 0:
         parser.error("batch-size must be a positive integer")
 
-    logger = setup_logging(args.log_level, args.log_file)
-
-    delete_old_files(
-        args.bucket_name,
-        args.folder_path,
-        args.days,
-        args.dry_run,
-        args.workers,
-        args.batch_size,
-        logger,
-    )
+    if args.use_async and aiohttp is None:
+        parser.error("--async requires aiohttp (uv sync --extra async)")
+
+    logger, log_listener = setup_logging(args.log_level, args.log_file)
+
+    try:
+        delete_old_files(
+            args.bucket_name,
+            args.folder_path,
+            args.days,
+            args.dry_run,
+            args.workers,
+            args.batch_size,
+            logger,
+            args.use_async,
+            args.quiet,
+            args.install_lifecycle,
+        )
+    finally:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.flush()
 
 
 if __name__ == "__main__":